@@ -1,12 +1,21 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
-import mysql.connector
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file, Response, stream_with_context
 import json
-from mysql.connector import Error
 from functools import wraps
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
+import io
+import multiprocessing
 import os
+import queue
+import time
+import zipfile
+
+import click
+
+from events import EventBus, format_sse
+from storage import create_storage, DatabaseError
 
 # Get the absolute path to the templates directory
 template_dir = os.path.abspath('templates')
@@ -15,6 +24,8 @@ app = Flask(__name__, template_folder=template_dir)
 app.secret_key = 'your-secret-key-here'  # Change this to a secure secret key in production
 
 # Database configuration
+DB_BACKEND = os.environ.get('DB_BACKEND', 'mysql')  # 'mysql' or 'sqlite'
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'pharmacy.db')
 DB_CONFIG = {
     'host': 'localhost',
     'user': 'root',
@@ -23,13 +34,19 @@ DB_CONFIG = {
     'auth_plugin': 'mysql_native_password'
 }
 
-def get_db_connection():
-    try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        return conn
-    except Error as e:
-        print(f"Error connecting to MySQL: {e}")
-        return None
+# Batch invoice rendering: number of worker processes and invoices per task
+INVOICE_BATCH_WORKERS = os.cpu_count() or 1
+INVOICE_BATCH_CHUNK_SIZE = 25
+
+# Dashboard low stock alert settings
+LOW_STOCK_THRESHOLD = 10
+DASHBOARD_LIST_LIMIT = 5
+
+# Seconds between keep-alive comments on idle dashboard event streams
+DASHBOARD_KEEPALIVE = 15
+
+db = create_storage(DB_BACKEND, mysql_config=DB_CONFIG, sqlite_path=SQLITE_PATH)
+dashboard_events = EventBus()
 
 # Login required decorator
 def login_required(f):
@@ -51,50 +68,75 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Dashboard change events
+
+def sale_event_data(sale):
+    return {
+        'sales_id': sale['sales_id'],
+        'customer_name': sale['customer_name'] or 'Walk-in Customer',
+        'sale_date': sale['sale_date'].strftime('%b %d, %Y %I:%M %p'),
+        'total_amount': '%.2f' % sale['total_amount'],
+        'url': url_for('view_sale', sales_id=sale['sales_id']),
+    }
+
+def publish_dashboard_changes(counts=False, low_stock=False, sales_id=None, recent_sales=False):
+    """Read what changed once and push it to every open dashboard.
+
+    Skips the reads entirely when no dashboard is listening. A failed read
+    is logged rather than failing the write that triggered it.
+    """
+    if not dashboard_events.has_subscribers:
+        return
+
+    try:
+        if counts:
+            dashboard_events.publish('counts', db.dashboard_counts(), only_if_changed=True)
+        if sales_id is not None:
+            sale = db.sale_summary(sales_id)
+            if sale:
+                dashboard_events.publish('sale', sale_event_data(sale))
+        if recent_sales:
+            sales = [sale_event_data(sale) for sale in db.recent_sales(DASHBOARD_LIST_LIMIT)]
+            dashboard_events.publish('recent_sales', sales, only_if_changed=True)
+        if low_stock:
+            items = [{'medicines_id': item['medicines_id'], 'name': item['name'], 'quantity': item['quantity']}
+                     for item in db.low_stock(LOW_STOCK_THRESHOLD, DASHBOARD_LIST_LIMIT)]
+            dashboard_events.publish('low_stock', items, only_if_changed=True)
+    except DatabaseError as e:
+        app.logger.warning(f'Could not publish dashboard changes: {e}')
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if 'user_id' in session:
         return redirect(url_for('dashboard'))
-        
+
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
-        
+
         if not username or not password:
             flash('Please enter both username and password', 'danger')
             return render_template('login.html')
-            
-        conn = get_db_connection()
-        if conn:
-            try:
-                cursor = conn.cursor(dictionary=True)
-                cursor.execute(
-                    'SELECT * FROM user WHERE username = %s', 
-                    (username,)
-                )
-                user = cursor.fetchone()
-                
-                if user and check_password_hash(user['password_hash'], password):
-                    session['user_id'] = user['user_id']
-                    session['username'] = user['username']
-                    session['email'] = user['email']
-                    session['is_admin'] = bool(user['is_admin'])
-                    
-                    flash('Login successful!', 'success')
-                    next_page = request.args.get('next')
-                    return redirect(next_page or url_for('dashboard'))
-                else:
-                    flash('Invalid username or password', 'danger')
-                    
-            except Error as e:
-                flash('An error occurred. Please try again.', 'danger')
-                print(f"Database error: {e}")
-            finally:
-                cursor.close()
-                conn.close()
-        else:
-            flash('Database connection error', 'danger')
-    
+
+        try:
+            user = db.get_user_by_username(username)
+
+            if user and check_password_hash(user['password_hash'], password):
+                session['user_id'] = user['user_id']
+                session['username'] = user['username']
+                session['email'] = user['email']
+                session['is_admin'] = bool(user['is_admin'])
+
+                flash('Login successful!', 'success')
+                next_page = request.args.get('next')
+                return redirect(next_page or url_for('dashboard'))
+            else:
+                flash('Invalid username or password', 'danger')
+
+        except DatabaseError as e:
+            flash('An error occurred. Please try again.', 'danger')
+            print(f"Database error: {e}")
+
     return render_template('login.html')
 
 @app.route('/logout')
@@ -108,82 +150,56 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    conn = get_db_connection()
-    if conn:
+    try:
+        summary = db.dashboard_summary(LOW_STOCK_THRESHOLD, DASHBOARD_LIST_LIMIT)
+        return render_template('dashboard.html',
+                             medicine_count=summary['medicine_count'],
+                             customer_count=summary['customer_count'],
+                             recent_sales=summary['recent_sales'],
+                             low_stock=summary['low_stock'],
+                             list_limit=DASHBOARD_LIST_LIMIT,
+                             is_admin=session.get('is_admin', False))
+
+    except DatabaseError as e:
+        flash('Error fetching dashboard data', 'danger')
+        print(f"Database error: {e}")
+        return render_template('dashboard.html', is_admin=session.get('is_admin', False))
+
+@app.route('/dashboard/events')
+@login_required
+def dashboard_stream():
+    subscriber = dashboard_events.subscribe()
+
+    def stream():
         try:
-            cursor = conn.cursor(dictionary=True)
-            
-            # Get counts for dashboard
-            cursor.execute('SELECT COUNT(*) as count FROM medicines')
-            medicine_count = cursor.fetchone()['count']
-            
-            cursor.execute('SELECT COUNT(*) as count FROM customers')
-            customer_count = cursor.fetchone()['count']
-            
-            # Get recent sales (last 5)
-            cursor.execute('''
-                SELECT s.sales_id, s.sale_date, c.name as customer_name, s.total_amount 
-                FROM sales s 
-                LEFT JOIN customers c ON s.phone = c.phone 
-                ORDER BY s.sale_date DESC 
-                LIMIT 5
-            ''')
-            recent_sales = cursor.fetchall()
-            
-            # Get low stock medicines
-            cursor.execute('''
-                SELECT * FROM medicines 
-                WHERE quantity < 10 
-                ORDER BY quantity ASC 
-                LIMIT 5
-            ''')
-            low_stock = cursor.fetchall()
-            
-            return render_template('dashboard.html', 
-                                 medicine_count=medicine_count,
-                                 customer_count=customer_count,
-                                 recent_sales=recent_sales,
-                                 low_stock=low_stock,
-                                 is_admin=session.get('is_admin', False))
-            
-        except Error as e:
-            flash('Error fetching dashboard data', 'danger')
-            print(f"Database error: {e}")
-            return render_template('dashboard.html', is_admin=session.get('is_admin', False))
+            # stream_with_context runs up to the first yield before the view
+            # returns, so send something now rather than after the first event
+            yield ': connected\n\n'
+            while True:
+                try:
+                    event, data = subscriber.get(timeout=DASHBOARD_KEEPALIVE)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield format_sse(event, data)
         finally:
-            cursor.close()
-            conn.close()
-    else:
-        flash('Database connection error', 'danger')
-        return render_template('dashboard.html', is_admin=session.get('is_admin', False))
+            dashboard_events.unsubscribe(subscriber)
+
+    return Response(stream_with_context(stream()),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/medicines')
 @login_required
 def list_medicines():
+    search = request.args.get('search', '')
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        
-        search = request.args.get('search', '')
-        if search:
-            cursor.execute('''
-                SELECT * FROM medicines 
-                WHERE name LIKE %s OR description LIKE %s OR manufacturer LIKE %s
-                ORDER BY name
-            ''', (f'%{search}%', f'%{search}%', f'%{search}%'))
-        else:
-            cursor.execute('SELECT * FROM medicines ORDER BY name')
-            
-        medicines = cursor.fetchall()
+        medicines = db.list_medicines(search)
         return render_template('medicines/list.html', medicines=medicines, search=search)
-        
-    except Error as e:
+
+    except DatabaseError as e:
         flash(f'Error retrieving medicines: {str(e)}', 'danger')
         return render_template('medicines/list.html', medicines=[])
-    finally:
-        if 'conn' in locals() and conn.is_connected():
-            cursor.close()
-            conn.close()
 
 @app.route('/medicines/add', methods=['GET', 'POST'])
 @login_required
@@ -196,29 +212,19 @@ def add_medicine():
             quantity = int(request.form['quantity'])
             manufacturer = request.form.get('manufacturer', '')
             expiry_date = request.form.get('expiry_date')
-            
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO medicines (name, description, price, quantity, manufacturer, expiry_date)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            ''', (name, description, price, quantity, manufacturer, expiry_date))
-            
-            conn.commit()
+
+            db.add_medicine(name, description, price, quantity, manufacturer, expiry_date,
+                            user_id=session['user_id'])
+            publish_dashboard_changes(counts=True, low_stock=True)
+
             flash('Medicine added successfully!', 'success')
             return redirect(url_for('list_medicines'))
-            
-        except Error as e:
-            conn.rollback()
+
+        except DatabaseError as e:
             flash(f'Error adding medicine: {str(e)}', 'danger')
         except ValueError:
             flash('Invalid input values', 'danger')
-        finally:
-            if 'conn' in locals() and conn.is_connected():
-                cursor.close()
-                conn.close()
-    
+
     return render_template('medicines/add.html')
 
 @app.route('/medicines/restock', methods=['POST'])
@@ -228,39 +234,19 @@ def restock_medicine():
         try:
             medicine_id = request.form['medicine_id']
             quantity = int(request.form['quantity'])
-            
-            conn = get_db_connection()
-            cursor = conn.cursor(dictionary=True)
-            
-            # Get current quantity
-            cursor.execute('SELECT quantity FROM medicines WHERE customer_id = %s', (medicine_id,))
-            current = cursor.fetchone()
-            
-            if not current:
+
+            if db.restock_medicine(medicine_id, quantity, user_id=session['user_id']) is None:
                 flash('Medicine not found', 'danger')
                 return redirect(url_for('list_medicines'))
-            
-            # Update quantity
-            new_quantity = current['quantity'] + quantity
-            cursor.execute('''
-                UPDATE medicines 
-                SET quantity = %s 
-                WHERE customer_id = %s
-            ''', (new_quantity, medicine_id))
-            
-            conn.commit()
+            publish_dashboard_changes(low_stock=True)
+
             flash(f'Successfully added {quantity} items to stock', 'success')
-            
-        except Error as e:
-            conn.rollback()
+
+        except DatabaseError as e:
             flash(f'Error updating stock: {str(e)}', 'danger')
         except ValueError:
             flash('Invalid quantity', 'danger')
-        finally:
-            if 'conn' in locals() and conn.is_connected():
-                cursor.close()
-                conn.close()
-    
+
     return redirect(url_for('list_medicines'))
 
 @app.route('/medicines/edit/<int:id>', methods=['GET', 'POST'])
@@ -274,72 +260,44 @@ def edit_medicine(id):
             quantity = int(request.form['quantity'])
             manufacturer = request.form.get('manufacturer', '')
             expiry_date = request.form.get('expiry_date')
-            
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE medicines 
-                SET name = %s, description = %s, price = %s, 
-                    quantity = %s, manufacturer = %s, expiry_date = %s
-                WHERE medicines_id = %s
-            ''', (name, description, price, quantity, manufacturer, expiry_date, id))
-            
-            conn.commit()
+
+            db.update_medicine(id, name, description, price, quantity, manufacturer, expiry_date,
+                               user_id=session['user_id'])
+            publish_dashboard_changes(low_stock=True)
+
             flash('Medicine updated successfully!', 'success')
             return redirect(url_for('list_medicines'))
-            
-        except Error as e:
-            conn.rollback()
+
+        except DatabaseError as e:
             flash(f'Error updating medicine: {str(e)}', 'danger')
         except ValueError:
             flash('Invalid input values', 'danger')
-        finally:
-            if 'conn' in locals() and conn.is_connected():
-                cursor.close()
-                conn.close()
-    
+
     # GET request - show edit form
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute('SELECT * FROM medicines WHERE medicines_id = %s', (id,))
-        medicine = cursor.fetchone()
-        
+        medicine = db.get_medicine(id)
+
         if not medicine:
             flash('Medicine not found', 'danger')
             return redirect(url_for('list_medicines'))
-            
+
         return render_template('medicines/edit_new.html', medicine=medicine)
-        
-    except Error as e:
+
+    except DatabaseError as e:
         flash(f'Error retrieving medicine: {str(e)}', 'danger')
         return redirect(url_for('list_medicines'))
-    finally:
-        if 'conn' in locals() and conn.is_connected():
-            cursor.close()
-            conn.close()
 
 @app.route('/medicines/delete/<int:id>', methods=['POST'])
 @login_required
 def delete_medicine(id):
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM medicines WHERE medicines_id = %s', (id,))
-        conn.commit()
-        
+        db.delete_medicine(id)
+        publish_dashboard_changes(counts=True, low_stock=True)
         flash('Medicine deleted successfully', 'success')
-        
-    except Error as e:
-        conn.rollback()
+
+    except DatabaseError as e:
         flash('Error deleting medicine', 'danger')
-    finally:
-        if 'conn' in locals() and conn.is_connected():
-            cursor.close()
-            conn.close()
-    
+
     return redirect(url_for('list_medicines'))
 
 # Customers Routes
@@ -347,30 +305,14 @@ def delete_medicine(id):
 @app.route('/customers')
 @login_required
 def list_customers():
+    search = request.args.get('search', '')
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        
-        search = request.args.get('search', '')
-        if search:
-            cursor.execute('''
-                SELECT * FROM customers 
-                WHERE name LIKE %s OR phone LIKE %s OR email LIKE %s
-                ORDER BY name
-            ''', (f'%{search}%', f'%{search}%', f'%{search}%'))
-        else:
-            cursor.execute('SELECT * FROM customers ORDER BY name')
-            
-        customers = cursor.fetchall()
+        customers = db.list_customers(search)
         return render_template('customers/list.html', customers=customers, search=search)
-        
-    except Error as e:
+
+    except DatabaseError as e:
         flash(f'Error retrieving customers: {str(e)}', 'danger')
         return render_template('customers/list.html', customers=[])
-    finally:
-        if 'conn' in locals() and conn.is_connected():
-            cursor.close()
-            conn.close()
 
 @app.route('/customers/add', methods=['GET', 'POST'])
 @login_required
@@ -381,67 +323,35 @@ def add_customer():
             phone = request.form.get('phone', '')
             email = request.form.get('email', '')
             address = request.form.get('address', '')
-            
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO customers (name, phone, email, address)
-                VALUES (%s, %s, %s, %s)
-            ''', (name, phone, email, address))
-            
-            conn.commit()
+
+            db.add_customer(name, phone, email, address)
+            publish_dashboard_changes(counts=True)
+
             flash('Customer added successfully!', 'success')
             return redirect(url_for('list_customers'))
-            
-        except Error as e:
-            conn.rollback()
+
+        except DatabaseError as e:
             flash(f'Error adding customer: {str(e)}', 'danger')
-        finally:
-            if 'conn' in locals() and conn.is_connected():
-                cursor.close()
-                conn.close()
-    
+
     return render_template('customers/add.html')
 
 @app.route('/customers/<int:id>')
 @login_required
 def view_customer(id):
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        
-        # Get customer details
-        cursor.execute('SELECT * FROM customers WHERE customer_id = %s', (id,))
-        customer = cursor.fetchone()
-        
+        customer, purchases = db.get_customer_with_purchases(id)
+
         if not customer:
             flash('Customer not found', 'danger')
             return redirect(url_for('list_customers'))
-        
-        # Get customer's purchase history
-        cursor.execute('''
-            SELECT s.sales_id, s.sale_date, s.total_amount, COUNT(si.id) as item_count
-            FROM sales s
-            LEFT JOIN sale_items si ON s.sales_id = si.sales_id
-            WHERE s.phone = %s
-            GROUP BY s.sales_id
-            ORDER BY s.sale_date DESC
-        ''', (id,))
-        
-        purchases = cursor.fetchall()
-        
-        return render_template('customers/view.html', 
-                             customer=customer, 
+
+        return render_template('customers/view.html',
+                             customer=customer,
                              purchases=purchases)
-        
-    except Error as e:
+
+    except DatabaseError as e:
         flash(f'Error retrieving customer: {str(e)}', 'danger')
         return redirect(url_for('list_customers'))
-    finally:
-        if 'conn' in locals() and conn.is_connected():
-            cursor.close()
-            conn.close()
 
 @app.route('/customers/edit/<int:id>', methods=['GET', 'POST'])
 @login_required
@@ -452,77 +362,44 @@ def edit_customer(id):
             phone = request.form.get('phone', '')
             email = request.form.get('email', '')
             address = request.form.get('address', '')
-            
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE customers 
-                SET name = %s, phone = %s, email = %s, address = %s
-                WHERE customer_id = %s
-            ''', (name, phone, email, address, id))
-            
-            conn.commit()
+
+            db.update_customer(id, name, phone, email, address)
+            publish_dashboard_changes(recent_sales=True)
+
             flash('Customer updated successfully!', 'success')
             return redirect(url_for('view_customer', id=id))
-            
-        except Error as e:
-            conn.rollback()
+
+        except DatabaseError as e:
             flash(f'Error updating customer: {str(e)}', 'danger')
-        finally:
-            if 'conn' in locals() and conn.is_connected():
-                cursor.close()
-                conn.close()
-    
+
     # GET request - show edit form
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute('SELECT * FROM customers WHERE customer_id = %s', (id,))
-        customer = cursor.fetchone()
-        
+        customer = db.get_customer(id)
+
         if not customer:
             flash('Customer not found', 'danger')
             return redirect(url_for('list_customers'))
-            
+
         return render_template('customers/edit.html', customer=customer)
-        
-    except Error as e:
+
+    except DatabaseError as e:
         flash(f'Error retrieving customer: {str(e)}', 'danger')
         return redirect(url_for('list_customers'))
-    finally:
-        if 'conn' in locals() and conn.is_connected():
-            cursor.close()
-            conn.close()
 
 @app.route('/customers/delete/<int:id>', methods=['POST'])
 @login_required
 def delete_customer(id):
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Check if customer has any sales
-        cursor.execute('SELECT COUNT(*) as sale_count FROM sales WHERE customer_id = %s', (id,))
-        result = cursor.fetchone()
-        
-        if result['sale_count'] > 0:
+        if not db.delete_customer(id):
             flash('Cannot delete customer with existing sales history', 'danger')
             return redirect(url_for('list_customers'))
-        
-        cursor.execute('DELETE FROM customers WHERE customer_id = %s', (id,))
-        conn.commit()
-        
+        publish_dashboard_changes(counts=True, recent_sales=True)
+
         flash('Customer deleted successfully', 'success')
-        
-    except Error as e:
-        conn.rollback()
+
+    except DatabaseError as e:
         flash('Error deleting customer', 'danger')
-    finally:
-        if 'conn' in locals() and conn.is_connected():
-            cursor.close()
-            conn.close()
-    
+
     return redirect(url_for('list_customers'))
 
 # Sales Routes
@@ -531,27 +408,12 @@ def delete_customer(id):
 @login_required
 def list_sales():
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        
-        cursor.execute('''
-            SELECT s.*, c.name as customer_name, u.username as user_name
-            FROM sales s
-            LEFT JOIN customers c ON s.phone = c.phone
-            LEFT JOIN user u ON s.user_id = u.user_id
-            ORDER BY s.sale_date DESC
-        ''')
-        
-        sales = cursor.fetchall()
+        sales = db.list_sales()
         return render_template('sales/list.html', sales=sales)
-        
-    except Error as e:
+
+    except DatabaseError as e:
         flash(f'Error retrieving sales: {str(e)}', 'danger')
         return render_template('sales/list.html', sales=[])
-    finally:
-        if 'conn' in locals() and conn.is_connected():
-            cursor.close()
-            conn.close()
 
 @app.route('/sales/new', methods=['GET', 'POST'])
 @login_required
@@ -559,171 +421,255 @@ def new_sale():
     if request.method == 'POST':
         try:
             customer_phone = request.form.get('customer_phone')
-            # Lookup customer_id by phone
-            conn = get_db_connection()
-            cursor = conn.cursor(dictionary=True)
-            # No need to look up customer_id; use phone directly
             items = json.loads(request.form['items'])
-            
+
             if not items:
                 flash('Please add at least one item to the sale', 'danger')
                 return redirect(url_for('new_sale'))
-            
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            # Calculate total amount
-            total_amount = sum(float(item['price']) * int(item['quantity']) for item in items)
-            
-            # Create sale record
-            cursor.execute('''
-                INSERT INTO sales (phone, user_id, total_amount)
-                VALUES (%s, %s, %s)
-            ''', (customer_phone, session['user_id'], total_amount))
-            
-            sales_id = cursor.lastrowid
-            
-            # Add sale items
-            for item in items:
-                cursor.execute('''
-                    INSERT INTO sale_items (sales_id, medicine_id, quantity, price)
-                    VALUES (%s, %s, %s, %s)
-                ''', (sales_id, item['medicine_id'], item['quantity'], item['price']))
-                
-                # Update medicine quantity
-                cursor.execute('''
-                    UPDATE medicines 
-                    SET quantity = quantity - %s 
-                    WHERE medicines_id = %s
-                ''', (item['quantity'], item['medicine_id']))
-            
-            conn.commit()
+
+            sales_id = db.create_sale(customer_phone, session['user_id'], items)
+            publish_dashboard_changes(sales_id=sales_id, low_stock=True)
+
             flash('Sale completed successfully!', 'success')
             return redirect(url_for('view_sale', sales_id=sales_id))
-            
-        except Error as e:
-            conn.rollback()
+
+        except DatabaseError as e:
             flash(f'Error processing sale: {str(e)}', 'danger')
         except json.JSONDecodeError:
             flash('Invalid items data', 'danger')
         except (ValueError, KeyError):
             flash('Invalid input values', 'danger')
-        finally:
-            if 'conn' in locals() and conn.is_connected():
-                cursor.close()
-                conn.close()
-    
+
     # For GET request, show the sale form
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        
         # Get customers for dropdown
-        cursor.execute('SELECT customer_id, phone FROM customers ORDER BY phone')
-        customers = cursor.fetchall()
-        
+        customers = db.customer_phones()
+
         # Get medicines for autocomplete
-        cursor.execute('SELECT medicines_id, name, price, quantity FROM medicines WHERE quantity > 0 ORDER BY name')
-        medicines = cursor.fetchall()
-        
-        return render_template('sales/new.html', 
-                             customers=customers, 
+        medicines = db.in_stock_medicines()
+
+        return render_template('sales/new.html',
+                             customers=customers,
                              medicines=medicines)
-        
-    except Error as e:
+
+    except DatabaseError as e:
         flash(f'Error loading sale form: {str(e)}', 'danger')
         return redirect(url_for('dashboard'))
-    finally:
-        if 'conn' in locals() and conn.is_connected():
-            cursor.close()
-            conn.close()
 
 @app.route('/sales/<int:sales_id>')
 @login_required
 def view_sale(sales_id):
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        
-        # Get sale details
-        cursor.execute('''
-            SELECT s.*, c.name as customer_name, c.phone, c.email,
-                   u.username as user_name
-            FROM sales s
-            LEFT JOIN customers c ON s.phone = c.phone
-            LEFT JOIN user u ON s.user_id = u.user_id
-            WHERE s.sales_id = %s
-        ''', (sales_id,))
-        
-        sale = cursor.fetchone()
+        sale, items = db.get_sale_with_items(sales_id)
+
         if not sale:
             flash('Sale not found', 'danger')
             return redirect(url_for('list_sales'))
-        
-        # Get sale items
-        cursor.execute('''
-            SELECT si.*, m.name as medicine_name, m.manufacturer
-            FROM sale_items si
-            JOIN medicines m ON si.medicine_id = m.medicines_id
-            WHERE si.sales_id = %s
-        ''', (sales_id,))
-        
-        items = cursor.fetchall()
-        
+
         return render_template('sales/view.html', sale=sale, items=items)
-        
-    except Error as e:
+
+    except DatabaseError as e:
         flash(f'Error retrieving sale details: {str(e)}', 'danger')
         return redirect(url_for('list_sales'))
-    finally:
-        if 'conn' in locals() and conn.is_connected():
-            cursor.close()
-            conn.close()
 
 @app.route('/sales/print/<int:sales_id>')
 @login_required
 def print_invoice(sales_id):
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        
-        # Get sale details
-        cursor.execute('''
-            SELECT s.*, c.name as customer_name, c.phone, c.email, c.address,
-                   u.username as user_name
-            FROM sales s
-            LEFT JOIN customers c ON s.phone = c.phone
-            LEFT JOIN user u ON s.user_id = u.user_id
-            WHERE s.sales_id = %s
-        ''', (sales_id,))
-        
-        sale = cursor.fetchone()
+        sale, items = db.get_sale_with_items(sales_id)
+
         if not sale:
             flash('Sale not found', 'danger')
             return redirect(url_for('list_sales'))
-        
-        # Get sale items
-        cursor.execute('''
-            SELECT si.*, m.name as medicine_name, m.manufacturer
-            FROM sale_items si
-            JOIN medicines m ON si.medicine_id = m.medicines_id
-            WHERE si.sales_id = %s
-        ''', (sales_id,))
-        
-        items = cursor.fetchall()
-        
-        return render_template('sales/print.html', 
-                             sale=sale, 
+
+        return render_template('sales/print.html',
+                             sale=sale,
                              items=items,
                              datetime=datetime)
-        
-    except Error as e:
+
+    except DatabaseError as e:
         flash(f'Error generating invoice: {str(e)}', 'danger')
         return redirect(url_for('view_sale', sales_id=sales_id))
+
+# Batch Invoice Routes
+
+def parse_date_range(start_date, end_date):
+    """Parse YYYY-MM-DD bounds (defaulting to today) into a half-open datetime range."""
+    today = datetime.now().strftime('%Y-%m-%d')
+    start = datetime.strptime(start_date or today, '%Y-%m-%d')
+    end = datetime.strptime(end_date or start_date or today, '%Y-%m-%d') + timedelta(days=1)
+    if end <= start:
+        raise ValueError('End date must not be before start date')
+    return start, end
+
+def render_invoice_chunk(chunk):
+    """Render a list of (sale, items) pairs with the print template.
+
+    Runs inside worker processes, so it builds its own request context.
+    """
+    with app.test_request_context():
+        return [(sale['sales_id'], render_template('sales/print.html',
+                                                   sale=sale,
+                                                   items=items,
+                                                   datetime=datetime))
+                for sale, items in chunk]
+
+def build_invoice_archive(invoices, output, workers=None, progress=None, mp_context=None):
+    """Render invoices in parallel and write them to output as a zip archive.
+
+    progress, if given, is called with the number of invoices finished after
+    each chunk completes. mp_context picks how worker processes are started.
+    Returns the elapsed rendering time in seconds.
+    """
+    workers = workers or INVOICE_BATCH_WORKERS
+    chunks = [invoices[i:i + INVOICE_BATCH_CHUNK_SIZE]
+              for i in range(0, len(invoices), INVOICE_BATCH_CHUNK_SIZE)]
+    started = time.perf_counter()
+
+    executor = None
+    if workers <= 1 or len(chunks) <= 1:
+        # Not worth paying process start-up for a single chunk
+        results = map(render_invoice_chunk, chunks)
+    else:
+        executor = ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=mp_context)
+        futures = [executor.submit(render_invoice_chunk, chunk) for chunk in chunks]
+        results = (future.result() for future in as_completed(futures))
+
+    try:
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for rendered in results:
+                for sales_id, html in rendered:
+                    archive.writestr(f'invoice_{sales_id:06d}.html', html)
+                if progress:
+                    progress(len(rendered))
     finally:
-        if 'conn' in locals() and conn.is_connected():
-            cursor.close()
-            conn.close()
+        if executor:
+            executor.shutdown(cancel_futures=True)
+
+    return time.perf_counter() - started
+
+@app.route('/sales/invoices/batch')
+@login_required
+@admin_required
+def batch_invoices():
+    try:
+        start, end = parse_date_range(request.args.get('start_date'),
+                                      request.args.get('end_date'))
+
+        invoices = db.invoice_batch(start, end)
+
+        if not invoices:
+            flash('No sales found for the selected dates', 'info')
+            return redirect(url_for('list_sales'))
+
+        # Forking the threaded web server could copy a lock held by another
+        # thread into the workers, so start them from a clean process instead
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        archive = io.BytesIO()
+        elapsed = build_invoice_archive(invoices, archive,
+                                        mp_context=multiprocessing.get_context(start_method))
+        archive.seek(0)
+
+        rate = len(invoices) / elapsed if elapsed else 0
+        app.logger.info(f'Rendered {len(invoices)} invoices in {elapsed:.2f}s ({rate:.1f}/s)')
+
+        last_day = end - timedelta(days=1)
+        response = send_file(archive,
+                             mimetype='application/zip',
+                             as_attachment=True,
+                             download_name=f'invoices_{start:%Y%m%d}_{last_day:%Y%m%d}.zip')
+        response.headers['X-Invoice-Count'] = str(len(invoices))
+        response.headers['X-Render-Seconds'] = f'{elapsed:.3f}'
+        response.headers['X-Invoices-Per-Second'] = f'{rate:.1f}'
+        return response
+
+    except ValueError:
+        flash('Invalid date range', 'danger')
+        return redirect(url_for('list_sales'))
+    except DatabaseError as e:
+        flash(f'Error generating invoices: {str(e)}', 'danger')
+        return redirect(url_for('list_sales'))
+
+@app.cli.command('batch-invoices')
+@click.option('--start-date', help='First day to include (YYYY-MM-DD), defaults to today.')
+@click.option('--end-date', help='Last day to include (YYYY-MM-DD), defaults to start date.')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help='Zip file to write.')
+@click.option('--workers', '-w', type=int, default=INVOICE_BATCH_WORKERS, show_default=True,
+              help='Number of rendering processes.')
+def batch_invoices_command(start_date, end_date, output, workers):
+    """Render every invoice in a date range into a zip archive."""
+    try:
+        start, end = parse_date_range(start_date, end_date)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+    try:
+        load_started = time.perf_counter()
+        invoices = db.invoice_batch(start, end)
+        load_elapsed = time.perf_counter() - load_started
+    except DatabaseError as e:
+        raise click.ClickException(f'Database error: {e}')
+
+    if not invoices:
+        click.echo('No sales found for the selected dates.')
+        return
+
+    last_day = end - timedelta(days=1)
+    output = output or f'invoices_{start:%Y%m%d}_{last_day:%Y%m%d}.zip'
+    click.echo(f'Loaded {len(invoices)} sales in {load_elapsed:.2f}s')
+
+    with click.progressbar(length=len(invoices), label='Rendering invoices') as bar:
+        elapsed = build_invoice_archive(invoices, output, workers=workers, progress=bar.update)
+
+    rate = len(invoices) / elapsed if elapsed else 0
+    click.echo(f'Wrote {len(invoices)} invoices to {output} in {elapsed:.2f}s ({rate:.1f} invoices/s)')
+
+# Stock Ledger Commands
+
+@app.cli.command('snapshot-stock')
+def snapshot_stock_command():
+    """Snapshot ledger totals so past stock levels replay from a recent point."""
+    try:
+        count = db.snapshot_stock()
+    except DatabaseError as e:
+        raise click.ClickException(f'Database error: {e}')
+    click.echo(f'Wrote {count} stock snapshots')
+
+@app.cli.command('stock-at')
+@click.argument('medicine_id', type=int)
+@click.option('--at', 'at', type=click.DateTime(), default=None,
+              help='Point in time to reconstruct, defaults to now.')
+def stock_at_command(medicine_id, at):
+    """Show a medicine's stock level at a past time, rebuilt from the ledger."""
+    at = at or datetime.now()
+    try:
+        quantity = db.stock_at(medicine_id, at)
+    except DatabaseError as e:
+        raise click.ClickException(f'Database error: {e}')
+    click.echo(f'Medicine {medicine_id} stock at {at:%Y-%m-%d %H:%M:%S}: {quantity}')
+
+@app.cli.command('reconcile-stock')
+@click.option('--adjust', is_flag=True,
+              help='Append ledger adjustments so the ledger matches medicines.quantity.')
+def reconcile_stock_command(adjust):
+    """Check every medicine's quantity against its stock ledger total."""
+    try:
+        discrepancies = db.stock_discrepancies()
+        if not discrepancies:
+            click.echo('Stock ledger matches medicine quantities.')
+            return
+
+        for row in discrepancies:
+            click.echo(f"{row['medicines_id']:>6}  {row['name']:<30}  quantity={row['quantity']:<6}  "
+                       f"ledger={row['ledger_quantity']:<6}  diff={row['quantity'] - row['ledger_quantity']:+d}")
+
+        if adjust:
+            db.record_adjustments(discrepancies)
+            click.echo(f'Recorded {len(discrepancies)} ledger adjustments.')
+        else:
+            raise click.ClickException(f'{len(discrepancies)} medicines do not match the stock ledger')
+    except DatabaseError as e:
+        raise click.ClickException(f'Database error: {e}')
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,64 @@
+"""In-process change events for live dashboard updates.
+
+Write routes publish small events after they commit. Each open dashboard
+holds a subscription and receives the events over server-sent events.
+The bus lives in one process, so with several server processes every
+process only sees the writes it handled.
+"""
+import json
+import queue
+import threading
+
+
+class EventBus:
+    """Fan published events out to every subscriber's queue."""
+
+    def __init__(self, maxsize=100):
+        self.maxsize = maxsize
+        self._subscribers = set()
+        self._last = {}
+        self._lock = threading.Lock()
+
+    @property
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    def subscribe(self):
+        subscriber = queue.Queue(self.maxsize)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+            if not self._subscribers:
+                # Nobody saw the events we skipped, so the cache may be stale
+                self._last.clear()
+
+    def publish(self, event, data, only_if_changed=False):
+        """Queue an event for every subscriber.
+
+        With only_if_changed, an event whose data matches the last one
+        published under the same name is dropped.
+        """
+        with self._lock:
+            if only_if_changed and self._last.get(event) == data:
+                return
+            self._last[event] = data
+            subscribers = list(self._subscribers)
+
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((event, data))
+            except queue.Full:
+                # The client has fallen behind. Drop its backlog and have it
+                # reload the page instead of applying stale deltas.
+                with subscriber.mutex:
+                    subscriber.queue.clear()
+                subscriber.put_nowait(('reload', None))
+
+
+def format_sse(event, data):
+    """Encode an event in the text/event-stream wire format."""
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
@@ -49,3 +49,27 @@ CREATE TABLE IF NOT EXISTS sale_items (
     FOREIGN KEY (sales_id) REFERENCES sales(sales_id),
     FOREIGN KEY (medicine_id) REFERENCES medicines(medicines_id)
 );
+
+-- Append-only record of every stock change. quantity_change is signed:
+-- positive for stock in, negative for stock out.
+CREATE TABLE IF NOT EXISTS stock_movements (
+    movement_id INT AUTO_INCREMENT PRIMARY KEY,
+    medicine_id INT NOT NULL,
+    quantity_change INT NOT NULL,
+    reason VARCHAR(20) NOT NULL,
+    reference_id INT,
+    user_id INT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    KEY idx_stock_movements_medicine (medicine_id, movement_id),
+    KEY idx_stock_movements_created (created_at)
+);
+
+-- Ledger total for a medicine as of movement_id, written by `flask snapshot-stock`
+CREATE TABLE IF NOT EXISTS stock_snapshots (
+    snapshot_id INT AUTO_INCREMENT PRIMARY KEY,
+    medicine_id INT NOT NULL,
+    quantity INT NOT NULL,
+    movement_id INT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    KEY idx_stock_snapshots_medicine (medicine_id, movement_id)
+);
@@ -0,0 +1,81 @@
+-- Database: pharmacy_management (SQLite backend)
+
+CREATE TABLE IF NOT EXISTS customers (
+    customer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name VARCHAR(100) NOT NULL,
+    phone VARCHAR(20) NOT NULL,
+    email VARCHAR(100),
+    address TEXT,
+    created_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+);
+
+CREATE TABLE IF NOT EXISTS medicines (
+    medicines_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name VARCHAR(255) NOT NULL,
+    description TEXT,
+    price DECIMAL(10,2) NOT NULL,
+    quantity INT NOT NULL DEFAULT 0,
+    manufacturer VARCHAR(100),
+    expiry_date DATE,
+    created_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+);
+
+CREATE TABLE IF NOT EXISTS user (
+    user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username VARCHAR(64) NOT NULL UNIQUE,
+    email VARCHAR(120) NOT NULL UNIQUE,
+    password_hash VARCHAR(128),
+    is_admin TINYINT(1)
+);
+
+CREATE TABLE IF NOT EXISTS sales (
+    sales_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    customer_id INT,
+    phone VARCHAR(20),
+    user_id INT NOT NULL,
+    total_amount DECIMAL(10,2) NOT NULL,
+    sale_date TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+    FOREIGN KEY (customer_id) REFERENCES customers(customer_id),
+    FOREIGN KEY (user_id) REFERENCES user(user_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_sales_sale_date ON sales (sale_date);
+CREATE INDEX IF NOT EXISTS idx_sales_phone ON sales (phone);
+
+CREATE TABLE IF NOT EXISTS sale_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sales_id INT NOT NULL,
+    medicine_id INT NOT NULL,
+    quantity INT NOT NULL,
+    price DECIMAL(10,2) NOT NULL,
+    FOREIGN KEY (sales_id) REFERENCES sales(sales_id),
+    FOREIGN KEY (medicine_id) REFERENCES medicines(medicines_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_sale_items_sales_id ON sale_items (sales_id);
+
+-- Append-only record of every stock change. quantity_change is signed:
+-- positive for stock in, negative for stock out.
+CREATE TABLE IF NOT EXISTS stock_movements (
+    movement_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    medicine_id INT NOT NULL,
+    quantity_change INT NOT NULL,
+    reason VARCHAR(20) NOT NULL,
+    reference_id INT,
+    user_id INT,
+    created_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+);
+
+CREATE INDEX IF NOT EXISTS idx_stock_movements_medicine ON stock_movements (medicine_id, movement_id);
+CREATE INDEX IF NOT EXISTS idx_stock_movements_created ON stock_movements (created_at);
+
+-- Ledger total for a medicine as of movement_id, written by `flask snapshot-stock`
+CREATE TABLE IF NOT EXISTS stock_snapshots (
+    snapshot_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    medicine_id INT NOT NULL,
+    quantity INT NOT NULL,
+    movement_id INT NOT NULL,
+    created_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+);
+
+CREATE INDEX IF NOT EXISTS idx_stock_snapshots_medicine ON stock_snapshots (medicine_id, movement_id);
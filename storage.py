@@ -0,0 +1,646 @@
+"""Data access for the pharmacy app.
+
+Routes talk to a Storage object from create_storage() instead of opening
+database connections themselves. The queries are written once, with %s
+placeholders, and each backend only supplies connections and cursors.
+"""
+import os
+import queue
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+
+try:
+    import mysql.connector
+except ImportError:  # SQLite-only installs don't need the MySQL driver
+    mysql = None
+
+# Exceptions the routes should treat as database failures
+DatabaseError = (sqlite3.Error,) if mysql is None else (sqlite3.Error, mysql.connector.Error)
+
+SQLITE_SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sqlite_schema.sql')
+
+# Keep SQLite values in the same Python types mysql.connector returns
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_converter('DECIMAL', lambda value: Decimal(value.decode()))
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter('DATE', lambda value: date.fromisoformat(value.decode()) if value else None)
+
+
+# Reasons recorded against stock movements
+MOVEMENT_INITIAL = 'initial'
+MOVEMENT_RESTOCK = 'restock'
+MOVEMENT_SALE = 'sale'
+MOVEMENT_ADJUSTMENT = 'adjustment'
+
+# Latest snapshot per medicine, for joining against the ledger
+LATEST_SNAPSHOTS = '''
+    SELECT ss.medicine_id, ss.quantity, ss.movement_id
+    FROM stock_snapshots ss
+    JOIN (SELECT medicine_id, MAX(movement_id) as movement_id
+          FROM stock_snapshots
+          GROUP BY medicine_id) latest
+      ON latest.medicine_id = ss.medicine_id AND latest.movement_id = ss.movement_id
+'''
+
+
+class Storage(ABC):
+    """Queries shared by every backend.
+
+    Subclasses provide cursor() for reads and transaction() for writes; both
+    are context managers yielding a cursor whose rows are dicts.
+    """
+
+    # Appended to SELECTs that read a row the transaction is about to update
+    for_update = ''
+
+    @abstractmethod
+    def cursor(self):
+        """Context manager yielding a cursor for reads."""
+
+    @abstractmethod
+    def transaction(self):
+        """Context manager yielding a cursor whose statements commit together."""
+
+    def prepare(self, query):
+        """Translate a %s-style query into the backend's paramstyle."""
+        return query
+
+    def execute(self, cursor, query, params=()):
+        cursor.execute(self.prepare(query), params)
+        return cursor
+
+    def executemany(self, cursor, query, seq_of_params):
+        cursor.executemany(self.prepare(query), seq_of_params)
+        return cursor
+
+    def record_movements(self, cursor, movements):
+        """Append (medicine_id, quantity_change, reason, reference_id, user_id) rows to the ledger.
+
+        Must be called with the cursor of the transaction making the change.
+        """
+        movements = [movement for movement in movements if movement[1]]
+        if movements:
+            self.executemany(cursor, '''
+                INSERT INTO stock_movements (medicine_id, quantity_change, reason, reference_id, user_id)
+                VALUES (%s, %s, %s, %s, %s)
+            ''', movements)
+
+    # Users
+
+    def get_user_by_username(self, username):
+        with self.cursor() as cursor:
+            return self.execute(cursor, 'SELECT * FROM user WHERE username = %s',
+                                (username,)).fetchone()
+
+    # Dashboard
+
+    def _counts(self, cursor):
+        return self.execute(cursor, '''
+            SELECT (SELECT COUNT(*) FROM medicines) as medicine_count,
+                   (SELECT COUNT(*) FROM customers) as customer_count
+        ''').fetchone()
+
+    def _recent_sales(self, cursor, limit, sales_id=None):
+        where = 'WHERE s.sales_id = %s' if sales_id is not None else ''
+        params = (sales_id, limit) if sales_id is not None else (limit,)
+        return self.execute(cursor, f'''
+            SELECT s.sales_id, s.sale_date, c.name as customer_name, s.total_amount
+            FROM sales s
+            LEFT JOIN customers c ON s.phone = c.phone
+            {where}
+            ORDER BY s.sale_date DESC
+            LIMIT %s
+        ''', params).fetchall()
+
+    def _low_stock(self, cursor, threshold, limit):
+        return self.execute(cursor, '''
+            SELECT * FROM medicines
+            WHERE quantity < %s
+            ORDER BY quantity ASC
+            LIMIT %s
+        ''', (threshold, limit)).fetchall()
+
+    def dashboard_summary(self, low_stock_threshold=10, limit=5):
+        with self.cursor() as cursor:
+            counts = self._counts(cursor)
+            recent_sales = self._recent_sales(cursor, limit)
+            low_stock = self._low_stock(cursor, low_stock_threshold, limit)
+
+        return {
+            'medicine_count': counts['medicine_count'],
+            'customer_count': counts['customer_count'],
+            'recent_sales': recent_sales,
+            'low_stock': low_stock,
+        }
+
+    def dashboard_counts(self):
+        with self.cursor() as cursor:
+            return self._counts(cursor)
+
+    def recent_sales(self, limit=5):
+        with self.cursor() as cursor:
+            return self._recent_sales(cursor, limit)
+
+    def sale_summary(self, sales_id):
+        """Return the dashboard row for one sale, or None."""
+        with self.cursor() as cursor:
+            rows = self._recent_sales(cursor, 1, sales_id=sales_id)
+        return rows[0] if rows else None
+
+    def low_stock(self, threshold=10, limit=5):
+        with self.cursor() as cursor:
+            return self._low_stock(cursor, threshold, limit)
+
+    # Medicines
+
+    def list_medicines(self, search=''):
+        with self.cursor() as cursor:
+            if search:
+                pattern = f'%{search}%'
+                self.execute(cursor, '''
+                    SELECT * FROM medicines
+                    WHERE name LIKE %s OR description LIKE %s OR manufacturer LIKE %s
+                    ORDER BY name
+                ''', (pattern, pattern, pattern))
+            else:
+                self.execute(cursor, 'SELECT * FROM medicines ORDER BY name')
+            return cursor.fetchall()
+
+    def in_stock_medicines(self):
+        with self.cursor() as cursor:
+            return self.execute(cursor, '''
+                SELECT medicines_id, name, price, quantity FROM medicines
+                WHERE quantity > 0
+                ORDER BY name
+            ''').fetchall()
+
+    def get_medicine(self, medicine_id):
+        with self.cursor() as cursor:
+            return self.execute(cursor, 'SELECT * FROM medicines WHERE medicines_id = %s',
+                                (medicine_id,)).fetchone()
+
+    def add_medicine(self, name, description, price, quantity, manufacturer, expiry_date, user_id=None):
+        with self.transaction() as cursor:
+            self.execute(cursor, '''
+                INSERT INTO medicines (name, description, price, quantity, manufacturer, expiry_date)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            ''', (name, description, price, quantity, manufacturer, expiry_date))
+            medicine_id = cursor.lastrowid
+
+            self.record_movements(cursor, [(medicine_id, quantity, MOVEMENT_INITIAL, None, user_id)])
+            return medicine_id
+
+    def update_medicine(self, medicine_id, name, description, price, quantity, manufacturer, expiry_date,
+                        user_id=None):
+        """Update a medicine, recording any quantity change as a ledger adjustment."""
+        with self.transaction() as cursor:
+            current = self.execute(cursor, 'SELECT quantity FROM medicines WHERE medicines_id = %s'
+                                   + self.for_update, (medicine_id,)).fetchone()
+            if not current:
+                return
+
+            self.execute(cursor, '''
+                UPDATE medicines
+                SET name = %s, description = %s, price = %s,
+                    quantity = %s, manufacturer = %s, expiry_date = %s
+                WHERE medicines_id = %s
+            ''', (name, description, price, quantity, manufacturer, expiry_date, medicine_id))
+
+            self.record_movements(cursor, [(medicine_id, quantity - current['quantity'],
+                                            MOVEMENT_ADJUSTMENT, None, user_id)])
+
+    def restock_medicine(self, medicine_id, quantity, user_id=None):
+        """Add quantity to a medicine's stock. Returns the new quantity, or None if not found."""
+        with self.transaction() as cursor:
+            current = self.execute(cursor, 'SELECT quantity FROM medicines WHERE medicines_id = %s'
+                                   + self.for_update, (medicine_id,)).fetchone()
+            if not current:
+                return None
+
+            new_quantity = current['quantity'] + quantity
+            self.execute(cursor, '''
+                UPDATE medicines
+                SET quantity = %s
+                WHERE medicines_id = %s
+            ''', (new_quantity, medicine_id))
+
+            self.record_movements(cursor, [(medicine_id, quantity, MOVEMENT_RESTOCK, None, user_id)])
+            return new_quantity
+
+    def delete_medicine(self, medicine_id):
+        with self.transaction() as cursor:
+            self.execute(cursor, 'DELETE FROM medicines WHERE medicines_id = %s', (medicine_id,))
+
+    # Customers
+
+    def list_customers(self, search=''):
+        with self.cursor() as cursor:
+            if search:
+                pattern = f'%{search}%'
+                self.execute(cursor, '''
+                    SELECT * FROM customers
+                    WHERE name LIKE %s OR phone LIKE %s OR email LIKE %s
+                    ORDER BY name
+                ''', (pattern, pattern, pattern))
+            else:
+                self.execute(cursor, 'SELECT * FROM customers ORDER BY name')
+            return cursor.fetchall()
+
+    def customer_phones(self):
+        with self.cursor() as cursor:
+            return self.execute(cursor, 'SELECT customer_id, phone FROM customers ORDER BY phone').fetchall()
+
+    def get_customer(self, customer_id):
+        with self.cursor() as cursor:
+            return self.execute(cursor, 'SELECT * FROM customers WHERE customer_id = %s',
+                                (customer_id,)).fetchone()
+
+    def get_customer_with_purchases(self, customer_id):
+        """Return (customer, purchases), or (None, []) if the customer doesn't exist."""
+        with self.cursor() as cursor:
+            customer = self.execute(cursor, 'SELECT * FROM customers WHERE customer_id = %s',
+                                    (customer_id,)).fetchone()
+            if not customer:
+                return None, []
+
+            purchases = self.execute(cursor, '''
+                SELECT s.sales_id, s.sale_date, s.total_amount, COUNT(si.id) as item_count
+                FROM sales s
+                LEFT JOIN sale_items si ON s.sales_id = si.sales_id
+                WHERE s.phone = %s
+                GROUP BY s.sales_id, s.sale_date, s.total_amount
+                ORDER BY s.sale_date DESC
+            ''', (customer['phone'],)).fetchall()
+            return customer, purchases
+
+    def add_customer(self, name, phone, email, address):
+        with self.transaction() as cursor:
+            self.execute(cursor, '''
+                INSERT INTO customers (name, phone, email, address)
+                VALUES (%s, %s, %s, %s)
+            ''', (name, phone, email, address))
+            return cursor.lastrowid
+
+    def update_customer(self, customer_id, name, phone, email, address):
+        with self.transaction() as cursor:
+            self.execute(cursor, '''
+                UPDATE customers
+                SET name = %s, phone = %s, email = %s, address = %s
+                WHERE customer_id = %s
+            ''', (name, phone, email, address, customer_id))
+
+    def delete_customer(self, customer_id):
+        """Delete a customer. Returns False, deleting nothing, if they have sales history."""
+        with self.transaction() as cursor:
+            # Sales are linked to customers by phone number
+            result = self.execute(cursor, '''
+                SELECT COUNT(*) as sale_count FROM sales
+                WHERE phone = (SELECT phone FROM customers WHERE customer_id = %s)
+            ''', (customer_id,)).fetchone()
+            if result['sale_count'] > 0:
+                return False
+
+            self.execute(cursor, 'DELETE FROM customers WHERE customer_id = %s', (customer_id,))
+            return True
+
+    # Sales
+
+    def list_sales(self):
+        with self.cursor() as cursor:
+            return self.execute(cursor, '''
+                SELECT s.*, c.name as customer_name, u.username as user_name
+                FROM sales s
+                LEFT JOIN customers c ON s.phone = c.phone
+                LEFT JOIN user u ON s.user_id = u.user_id
+                ORDER BY s.sale_date DESC
+            ''').fetchall()
+
+    def get_sale_with_items(self, sales_id):
+        """Return (sale, items), or (None, []) if the sale doesn't exist."""
+        with self.cursor() as cursor:
+            sale = self.execute(cursor, '''
+                SELECT s.*, c.name as customer_name, c.phone, c.email, c.address,
+                       u.username as user_name
+                FROM sales s
+                LEFT JOIN customers c ON s.phone = c.phone
+                LEFT JOIN user u ON s.user_id = u.user_id
+                WHERE s.sales_id = %s
+            ''', (sales_id,)).fetchone()
+            if not sale:
+                return None, []
+
+            items = self.execute(cursor, '''
+                SELECT si.*, m.name as medicine_name, m.manufacturer
+                FROM sale_items si
+                JOIN medicines m ON si.medicine_id = m.medicines_id
+                WHERE si.sales_id = %s
+            ''', (sales_id,)).fetchall()
+            return sale, items
+
+    def create_sale(self, phone, user_id, items):
+        """Record a sale and its items and take them out of stock. Returns the new sales_id."""
+        total_amount = sum(float(item['price']) * int(item['quantity']) for item in items)
+
+        with self.transaction() as cursor:
+            self.execute(cursor, '''
+                INSERT INTO sales (phone, user_id, total_amount)
+                VALUES (%s, %s, %s)
+            ''', (phone, user_id, total_amount))
+            sales_id = cursor.lastrowid
+
+            self.executemany(cursor, '''
+                INSERT INTO sale_items (sales_id, medicine_id, quantity, price)
+                VALUES (%s, %s, %s, %s)
+            ''', [(sales_id, item['medicine_id'], item['quantity'], item['price']) for item in items])
+
+            self.executemany(cursor, '''
+                UPDATE medicines
+                SET quantity = quantity - %s
+                WHERE medicines_id = %s
+            ''', [(item['quantity'], item['medicine_id']) for item in items])
+
+            self.record_movements(cursor, [(item['medicine_id'], -int(item['quantity']), MOVEMENT_SALE,
+                                            sales_id, user_id) for item in items])
+            return sales_id
+
+    def invoice_batch(self, start, end):
+        """Load every sale in [start, end) together with its items using two bulk queries."""
+        with self.cursor() as cursor:
+            sales = self.execute(cursor, '''
+                SELECT s.*, c.name as customer_name, c.phone, c.email, c.address,
+                       u.username as user_name
+                FROM sales s
+                LEFT JOIN customers c ON s.phone = c.phone
+                LEFT JOIN user u ON s.user_id = u.user_id
+                WHERE s.sale_date >= %s AND s.sale_date < %s
+                ORDER BY s.sales_id
+            ''', (start, end)).fetchall()
+            if not sales:
+                return []
+
+            items = self.execute(cursor, '''
+                SELECT si.*, m.name as medicine_name, m.manufacturer
+                FROM sale_items si
+                JOIN sales s ON si.sales_id = s.sales_id
+                JOIN medicines m ON si.medicine_id = m.medicines_id
+                WHERE s.sale_date >= %s AND s.sale_date < %s
+                ORDER BY si.sales_id, si.id
+            ''', (start, end)).fetchall()
+
+        items_by_sale = {}
+        for item in items:
+            items_by_sale.setdefault(item['sales_id'], []).append(item)
+
+        return [(sale, items_by_sale.get(sale['sales_id'], [])) for sale in sales]
+
+    # Stock ledger
+
+    def snapshot_stock(self):
+        """Snapshot the ledger total of every medicine with movements since its last snapshot.
+
+        Returns the number of snapshots written.
+        """
+        with self.transaction() as cursor:
+            last = self.execute(cursor, 'SELECT MAX(movement_id) as movement_id FROM stock_movements').fetchone()
+            if not last['movement_id']:
+                return 0
+
+            self.execute(cursor, f'''
+                INSERT INTO stock_snapshots (medicine_id, quantity, movement_id)
+                SELECT sm.medicine_id,
+                       COALESCE(ls.quantity, 0) + SUM(sm.quantity_change),
+                       MAX(sm.movement_id)
+                FROM stock_movements sm
+                LEFT JOIN ({LATEST_SNAPSHOTS}) ls ON ls.medicine_id = sm.medicine_id
+                WHERE sm.movement_id > COALESCE(ls.movement_id, 0) AND sm.movement_id <= %s
+                GROUP BY sm.medicine_id, ls.quantity
+            ''', (last['movement_id'],))
+            return cursor.rowcount
+
+    def stock_at(self, medicine_id, at):
+        """Reconstruct a medicine's stock level at a past datetime from the ledger.
+
+        Starts from the nearest snapshot at or before that point and replays
+        only the movements recorded after it.
+        """
+        with self.cursor() as cursor:
+            upto = self.execute(cursor, '''
+                SELECT MAX(movement_id) as movement_id FROM stock_movements
+                WHERE medicine_id = %s AND created_at <= %s
+            ''', (medicine_id, at)).fetchone()['movement_id']
+            if not upto:
+                return 0
+
+            snapshot = self.execute(cursor, '''
+                SELECT quantity, movement_id FROM stock_snapshots
+                WHERE medicine_id = %s AND movement_id <= %s
+                ORDER BY movement_id DESC
+                LIMIT 1
+            ''', (medicine_id, upto)).fetchone() or {'quantity': 0, 'movement_id': 0}
+
+            replayed = self.execute(cursor, '''
+                SELECT COALESCE(SUM(quantity_change), 0) as quantity FROM stock_movements
+                WHERE medicine_id = %s AND movement_id > %s AND movement_id <= %s
+            ''', (medicine_id, snapshot['movement_id'], upto)).fetchone()['quantity']
+
+        return int(snapshot['quantity'] + replayed)
+
+    def stock_discrepancies(self):
+        """Compare every medicine's quantity against its ledger total in one query.
+
+        Returns rows with medicines_id, name, quantity and ledger_quantity for
+        the medicines where the two disagree.
+        """
+        with self.cursor() as cursor:
+            rows = self.execute(cursor, f'''
+                SELECT md.medicines_id, md.name, md.quantity,
+                       COALESCE(ls.quantity, 0) + COALESCE(SUM(sm.quantity_change), 0) as ledger_quantity
+                FROM medicines md
+                LEFT JOIN ({LATEST_SNAPSHOTS}) ls ON ls.medicine_id = md.medicines_id
+                LEFT JOIN stock_movements sm
+                  ON sm.medicine_id = md.medicines_id AND sm.movement_id > COALESCE(ls.movement_id, 0)
+                GROUP BY md.medicines_id, md.name, md.quantity, ls.quantity
+                ORDER BY md.medicines_id
+            ''').fetchall()
+
+        for row in rows:
+            row['ledger_quantity'] = int(row['ledger_quantity'])
+        return [row for row in rows if row['quantity'] != row['ledger_quantity']]
+
+    def record_adjustments(self, discrepancies, user_id=None):
+        """Append ledger adjustments that bring each discrepancy back in line with medicines.quantity."""
+        with self.transaction() as cursor:
+            self.record_movements(cursor, [(row['medicines_id'], row['quantity'] - row['ledger_quantity'],
+                                            MOVEMENT_ADJUSTMENT, None, user_id) for row in discrepancies])
+
+
+class MySQLStorage(Storage):
+    """MySQL backend. Opens a connection per operation, as the app always has."""
+
+    for_update = ' FOR UPDATE'
+
+    def __init__(self, config):
+        if mysql is None:
+            raise RuntimeError('mysql-connector-python is required for the MySQL backend')
+        self.config = config
+
+    @contextmanager
+    def _connect(self):
+        conn = mysql.connector.connect(**self.config)
+        try:
+            cursor = conn.cursor(dictionary=True)
+            try:
+                yield conn, cursor
+            finally:
+                cursor.close()
+        finally:
+            conn.close()
+
+    @contextmanager
+    def cursor(self):
+        with self._connect() as (conn, cursor):
+            yield cursor
+
+    @contextmanager
+    def transaction(self):
+        with self._connect() as (conn, cursor):
+            try:
+                yield cursor
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+
+def _dict_factory(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+class SQLiteStorage(Storage):
+    """Embedded SQLite backend for single-store installs, tests and benchmarks.
+
+    Connections are kept in a small pool and reused across requests, so each
+    one's statement cache stays warm. Databases run in WAL mode with
+    memory-mapped reads. An in-memory database gets a single shared
+    connection, so every thread sees the same data.
+    """
+
+    def __init__(self, path, pool_size=8, timeout=5.0, mmap_size=256 * 1024 * 1024, cached_statements=256):
+        self.path = path
+        self.pool_size = 1 if path == ':memory:' else pool_size
+        self.timeout = timeout
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+        self._pool = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path,
+                               timeout=self.timeout,
+                               detect_types=sqlite3.PARSE_DECLTYPES,
+                               isolation_level=None,
+                               check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        conn.row_factory = _dict_factory
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute('PRAGMA foreign_keys = ON')
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        with self._lock:
+            if not self._schema_ready:
+                with open(SQLITE_SCHEMA_PATH) as f:
+                    conn.executescript(f.read())
+                self._schema_ready = True
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._opened < self.pool_size
+            if can_open:
+                self._opened += 1
+        if can_open:
+            try:
+                return self._connect()
+            except BaseException:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        try:
+            return self._pool.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError('Timed out waiting for a database connection')
+
+    @contextmanager
+    def _connection(self):
+        # Not re-entrant: with a pool of one, a nested cursor() would wait forever
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def prepare(query):
+        return query.replace('%s', '?')
+
+    @contextmanager
+    def cursor(self):
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    @contextmanager
+    def transaction(self):
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                # Take the write lock up front so concurrent writers queue on
+                # busy_timeout instead of failing with a lock upgrade deadlock
+                cursor.execute('BEGIN IMMEDIATE')
+                yield cursor
+                cursor.execute('COMMIT')
+            except BaseException:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def close(self):
+        """Close every idle pooled connection."""
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+
+def create_storage(backend, mysql_config=None, sqlite_path=None):
+    """Return the Storage for the configured backend ('mysql' or 'sqlite')."""
+    if backend == 'mysql':
+        return MySQLStorage(mysql_config)
+    if backend == 'sqlite':
+        return SQLiteStorage(sqlite_path)
+    raise ValueError(f'Unknown database backend: {backend}')
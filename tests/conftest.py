@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import SQLiteStorage
+
+
+@pytest.fixture
+def db():
+    storage = SQLiteStorage(':memory:')
+    with storage.transaction() as cursor:
+        storage.execute(cursor, '''
+            INSERT INTO user (username, email, password_hash, is_admin)
+            VALUES (%s, %s, %s, %s)
+        ''', ('admin', 'admin@example.com', 'x', 1))
+    yield storage
+    storage.close()
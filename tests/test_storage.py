@@ -0,0 +1,67 @@
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+
+def test_create_sale_records_items_and_takes_stock(db):
+    medicine_id = db.add_medicine('Aspirin', '', 2.5, 20, 'Acme', None)
+    db.add_customer('Bob', '555', '', '')
+
+    sales_id = db.create_sale('555', 1, [{'medicine_id': medicine_id, 'quantity': 3, 'price': 2.5}])
+
+    sale, items = db.get_sale_with_items(sales_id)
+    assert sale['customer_name'] == 'Bob'
+    assert sale['total_amount'] == Decimal('7.5')
+    assert isinstance(sale['sale_date'], datetime)
+    assert [(item['medicine_name'], item['quantity']) for item in items] == [('Aspirin', 3)]
+    assert db.get_medicine(medicine_id)['quantity'] == 17
+    assert db.stock_discrepancies() == []
+
+
+def test_delete_customer_refuses_customers_with_sales(db):
+    medicine_id = db.add_medicine('Aspirin', '', 2.5, 20, '', None)
+    with_sales = db.add_customer('Bob', '555', '', '')
+    without_sales = db.add_customer('Ann', '777', '', '')
+    db.create_sale('555', 1, [{'medicine_id': medicine_id, 'quantity': 1, 'price': 2.5}])
+
+    assert db.delete_customer(with_sales) is False
+    assert db.get_customer(with_sales) is not None
+
+    assert db.delete_customer(without_sales) is True
+    assert db.get_customer(without_sales) is None
+
+
+def test_restock_medicine(db):
+    medicine_id = db.add_medicine('Aspirin', '', 2.5, 4, '', None)
+
+    assert db.restock_medicine(medicine_id, 6) == 10
+    assert db.get_medicine(medicine_id)['quantity'] == 10
+    assert db.stock_at(medicine_id, datetime.now() + timedelta(seconds=1)) == 10
+    assert db.restock_medicine(medicine_id + 1, 6) is None
+
+
+def test_invoice_batch_groups_items_by_sale(db):
+    aspirin = db.add_medicine('Aspirin', '', 2.5, 20, '', None)
+    ibuprofen = db.add_medicine('Ibuprofen', '', 4.0, 20, '', None)
+    first = db.create_sale('555', 1, [{'medicine_id': aspirin, 'quantity': 1, 'price': 2.5},
+                                      {'medicine_id': ibuprofen, 'quantity': 2, 'price': 4.0}])
+    second = db.create_sale('555', 1, [{'medicine_id': ibuprofen, 'quantity': 1, 'price': 4.0}])
+
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    invoices = db.invoice_batch(today, today + timedelta(days=1))
+
+    assert [sale['sales_id'] for sale, items in invoices] == [first, second]
+    assert [len(items) for sale, items in invoices] == [2, 1]
+    assert db.invoice_batch(today - timedelta(days=1), today) == []
+
+
+def test_point_lookup_is_sub_millisecond(db):
+    medicine_id = db.add_medicine('Aspirin', '', 2.5, 20, '', None)
+    runs = 1000
+
+    started = time.perf_counter()
+    for _ in range(runs):
+        db.get_medicine(medicine_id)
+    elapsed = (time.perf_counter() - started) / runs
+
+    assert elapsed < 0.001